@@ -1,17 +1,34 @@
 """NHS/LBS chat agent session management, tools, and deterministic flows."""
 
-import json
+import copy
+import hashlib
+import logging
 import os
+import random
 import re
+import threading
 import time
-from typing import Any, Dict, List, Optional
-
-from dotenv import load_dotenv
-from openai import OpenAI, RateLimitError
-
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+from itertools import islice
+from types import MappingProxyType
+from typing import Any, Callable, Deque, Dict, List, Mapping, Optional, Tuple
+
+import orjson
+from cachetools import TTLCache
+from openai import BadRequestError, NotFoundError, OpenAI, RateLimitError
+
+try:
+    import tiktoken
+except ImportError:  # optional: token counts fall back to a length heuristic
+    tiktoken = None
+
+from openai_client import client
 from prompts import intro_prompt, build_system_prompt
 from tools import (
     guided_search,
+    is_emergency_message,
     nhs_111_live_triage,
     tool_nearest_nhs_services,
     tool_onboarding,
@@ -19,47 +36,503 @@ from tools import (
     tools,
 )
 
-load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY)
+logger = logging.getLogger(__name__)
 
 
-PROFILE_TAG_RE = re.compile(r"<USER_PROFILE>.*?</USER_PROFILE>", re.DOTALL)
+_prewarm_started = threading.Event()
 
 
-def extract_profile(text: str) -> Optional[Dict[str, Any]]:
-    """Extract JSON profile dict from assistant text, if present."""
-    match = re.search(r"<USER_PROFILE>(.*?)</USER_PROFILE>", text, re.DOTALL)
-    if not match:
+def _prewarm(api: OpenAI) -> None:
+    try:
+        api.with_options(timeout=5.0).models.list()
+    except Exception:
+        pass
+
+
+def prewarm_connection(api: OpenAI) -> None:
+    """Open a pooled connection (DNS + TCP + TLS) in the background, once per process."""
+    if _prewarm_started.is_set():
+        return
+    _prewarm_started.set()
+    threading.Thread(target=_prewarm, args=(api,), name="openai-prewarm", daemon=True).start()
+
+
+# Run independent tool calls from one model response concurrently (PARALLEL_TOOLS=0 to opt out).
+PARALLEL_TOOLS = os.getenv("PARALLEL_TOOLS", "1") != "0"
+TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="agent-tool")
+
+
+# OpenAI reset headers look like "1s", "6m0s" or "250ms".
+RESET_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _parse_reset(value: str) -> Optional[float]:
+    """Seconds encoded in an x-ratelimit-reset-* header, or None if unparseable."""
+    parts = RESET_DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def retry_delay(exc: RateLimitError, attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    """
+    Seconds to wait before a retry: Retry-After, else the x-ratelimit-reset-* hint,
+    else exponential backoff with jitter.
+    """
+    response = getattr(exc, "response", None)
+    headers = response.headers if response is not None else {}
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return min(float(retry_after), cap)
+        except ValueError:
+            pass
+    resets = [_parse_reset(headers.get(name) or "") for name in ("x-ratelimit-reset-tokens", "x-ratelimit-reset-requests")]
+    resets = [r for r in resets if r is not None]
+    if resets:
+        return min(max(resets), cap)
+    # multiplicative jitter spreads concurrent sessions apart instead of retrying in lockstep
+    return min(base * 2**attempt, cap) * random.uniform(0.5, 1.5)
+
+
+# Process-wide LRU of text-only model responses keyed on the exact request payload.
+RESPONSE_CACHE_SIZE = 256
+_RESPONSE_CACHE: "OrderedDict[str, Any]" = OrderedDict()
+_RESPONSE_CACHE_LOCK = threading.Lock()
+
+
+def _response_cache_key(kwargs: Dict[str, Any]) -> str:
+    """Stable digest of a responses.create payload."""
+    return hashlib.sha1(orjson.dumps(kwargs, option=orjson.OPT_SORT_KEYS, default=str)).hexdigest()
+
+
+def _cached_response(key: str) -> Any:
+    with _RESPONSE_CACHE_LOCK:
+        resp = _RESPONSE_CACHE.get(key)
+        if resp is not None:
+            _RESPONSE_CACHE.move_to_end(key)
+        return resp
+
+
+def _remember_response(key: str, resp: Any) -> None:
+    """
+    Cache a completed response unless it requests tool calls (those must run every time).
+    Truncated (status "incomplete") and failed replies are never reused.
+    """
+    if getattr(resp, "status", None) != "completed":
+        return
+    if any(getattr(item, "type", None) == "function_call" for item in getattr(resp, "output", None) or []):
+        return
+    with _RESPONSE_CACHE_LOCK:
+        _RESPONSE_CACHE[key] = resp
+        _RESPONSE_CACHE.move_to_end(key)
+        if len(_RESPONSE_CACHE) > RESPONSE_CACHE_SIZE:
+            _RESPONSE_CACHE.popitem(last=False)
+
+
+@lru_cache(maxsize=1)
+def _token_encoder() -> Any:
+    """gpt-4o-mini tokenizer, or None when tiktoken (or its encoding file) is unavailable."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model("gpt-4o-mini")
+    except Exception:
         return None
-    raw = match.group(1).strip()
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """Token count for a message body; each distinct string is encoded once."""
+    encoder = _token_encoder()
+    if encoder is None:
+        return len(text) // 4 + 1
+    return len(encoder.encode(text))
+
+
+def _dumps(obj: Any) -> str:
+    """Serialize to a JSON str with orjson (the Responses API expects text)."""
+    return orjson.dumps(obj).decode()
+
+
+_loads = orjson.loads
+
+
+PROFILE_OPEN_TAG = "<USER_PROFILE>"
+PROFILE_CLOSE_TAG = "</USER_PROFILE>"
+
+
+def _profile_span(text: str) -> Optional[Tuple[int, int]]:
+    """(open tag index, close tag index) of the first complete profile tag, via plain substring search."""
+    open_at = text.find(PROFILE_OPEN_TAG)
+    if open_at < 0:
+        return None
+    close_at = text.find(PROFILE_CLOSE_TAG, open_at + len(PROFILE_OPEN_TAG))
+    if close_at < 0:
+        return None
+    return open_at, close_at
+
+
+def _parse_profile_payload(raw: str) -> Optional[Dict[str, Any]]:
+    """Parse the JSON payload captured between profile tags."""
+    raw = raw.strip()
     if not raw:
         return None
     try:
-        return json.loads(raw)
-    except json.JSONDecodeError:
+        return _loads(raw)
+    except orjson.JSONDecodeError:
         return None
 
 
-def strip_profile_tag(text: str) -> str:
-    """Remove profile tag wrapper so only user-facing content remains."""
-    return PROFILE_TAG_RE.sub("", text).strip()
+def split_profile(text: str) -> Tuple[Optional[Dict[str, Any]], str]:
+    """Return (profile, cleaned text) from a single pass over the reply."""
+    span = _profile_span(text)
+    if span is None:
+        return None, text.strip()
+    open_at, close_at = span
+    profile = _parse_profile_payload(text[open_at + len(PROFILE_OPEN_TAG) : close_at])
+    return profile, (text[:open_at] + text[close_at + len(PROFILE_CLOSE_TAG) :]).strip()
+
+
+# Keyword matchers for onboarding answers / triage summaries (inputs are lowercased).
+LONG_STAY_RE = re.compile(r"year|yr|6|twelve|12|long|permanent|settled")
+UK_STATUS_RE = re.compile(r"student|work|skilled|settled|ilr|british|uk")
+YES_RE = re.compile(r"\b(yes|y|true|1)\b")
+DEHYDRATED_RE = re.compile(r"no|not|can't|cannot|unable")
+SKIP_TOKENS = frozenset({"skip", "prefer not to say", "n/a", "na"})
+SKIP_TOKEN_MAX_LEN = max(map(len, SKIP_TOKENS))
+
+# Eligibility questions short-circuit to the deterministic checklist.
+ELIGIBILITY_RE = re.compile(r"eligib(?:le|ility)", re.IGNORECASE)
+# Whole-message onboarding requests (the prompt's Rule 1 triggers); anything longer goes to the model.
+ONBOARDING_TRIGGER_RE = re.compile(
+    r"(?:please\s+)?(?:(?:start|redo|begin)\s+)?on\s?boarding"
+    r"|on\s?board\s+me|set\s+up\s+my\s+profile|update\s+my\s+details|build\s+my\s+onboarding\s+profile",
+    re.IGNORECASE,
+)
+
+ELIGIBILITY_TEMPLATE = (
+    "Based on your details, here are likely options:\n"
+    "- {gp}\n"
+    "- Urgent and emergency care (NHS 111, A&E) are available regardless of GP registration."
+    "{registered}{location}\n"
+    "If you'd like, I can look up nearby GP practices or urgent care options."
+)
+
+NUM_RE = re.compile(r"\d+(?:\.\d+)?")
+TRIAGE_SUMMARY_TEMPLATE = (
+    "Thanks, here's a quick triage summary (following NHS 111 style steps):\n"
+    "- Severity: {severity}\n"
+    "- Fluids: {fluids}\n"
+    "- Onset: {onset}\n"
+    "- Red flags: {red_flags}\n"
+    "- Other: {other}\n\n"
+    "{route}\n"
+    "{postcode_note} If you want, I can also help with GP registration or local services."
+)
+
+# Mode note attached to the latest user message while triage is active.
+TRIAGE_MODE_NOTE_TEMPLATE = (
+    "TRIAGE MODE IS ACTIVE. "
+    "Do NOT call onboarding unless user explicitly says 'onboarding'. "
+    "Use nhs_111_live_triage with known_answers={known_answers}. "
+    "Ask only triage follow-up questions until triage status='final'. "
+    "Do NOT repeat topics already in known_answers (e.g., severity, onset, injury/trauma, functional ability, red flags already covered). "
+    "You have already asked {asked} follow-ups. "
+    "Tailor follow-ups to the presenting issue, keep them concise, aim to finish within 5-8 questions, and NEVER exceed 10; if you already have 5 answers or 5 questions asked, move to a final decision."
+)
+
+# Triage topics (known_answers key fragment, question phrase) for the no-LLM blank-reply fallback.
+TRIAGE_FALLBACK_TOPICS = (
+    ("severity", "how severe it is on a scale of 0 to 10"),
+    ("onset", "when it started and whether it came on suddenly"),
+    ("function", "whether you can walk, eat, breathe and get about normally"),
+    ("red_flag", "any chest pain, trouble breathing, heavy bleeding or sudden weakness"),
+)
+
+CANONICAL_LINKS = (
+    ("Find a GP", "https://www.nhs.uk/service-search/find-a-gp"),
+    ("Register with a GP", "https://www.nhs.uk/nhs-services/gps/how-to-register-with-a-gp-surgery/"),
+    ("Use NHS 111 online", "https://111.nhs.uk/"),
+    ("NHS services guide", "https://www.nhs.uk/using-the-nhs/nhs-services/"),
+    ("LBS health and wellbeing", "https://www.london.edu/masters-experience/student-support"),
+    ("LBS mental wellbeing support", "https://www.london.edu/masters-experience/student-support/mental-health"),
+)
+USEFUL_LINKS_SECTION = "\n".join(["Useful links", *[f"- {title}: {url}" for title, url in CANONICAL_LINKS]])
+
+# "Useful links" header line; the section runs to the next blank line.
+USEFUL_LINKS_HEADER_RE = re.compile(r"^[ \t]*useful links", re.IGNORECASE | re.MULTILINE)
+BLANK_LINE_RE = re.compile(r"\n[ \t]*(?:\n|$)")
+
+
+FALLBACK_PROMPT_SUGGESTIONS = (
+    "Find nearby GP or A&E",
+    "How to register with a GP",
+    "What to do for my symptoms now",
+)
+PROFILE_FOLLOWUPS_FALLBACK = (
+    "Here are a few next steps you might find useful:\n"
+    "1) Find nearby GP practices and register.\n"
+    "2) Book a routine health check or vaccination if due.\n"
+    "3) Explore local mental wellbeing resources.\n"
+    "If you want, I can look up nearby services based on your postcode."
+)
+
+
+# First flat JSON array in a reply (models sometimes wrap it in code fences or prose).
+JSON_ARRAY_RE = re.compile(r"\[[^\[\]]*\]")
+
+
+def _parse_json_list(raw: str) -> Any:
+    """Parse a model reply that should be a JSON list, skipping any text around the array."""
+    match = JSON_ARRAY_RE.search(raw)
+    if not match:
+        return []
+    try:
+        return _loads(match.group(0))
+    except orjson.JSONDecodeError:
+        return []
+
+
+def _parse_json_object(raw: str) -> Any:
+    """Parse a model reply that should be a JSON object, from its first "{" to its last "}"."""
+    start, end = raw.find("{"), raw.rfind("}")
+    if start == -1 or end < start:
+        return {}
+    try:
+        return _loads(raw[start : end + 1])
+    except orjson.JSONDecodeError:
+        return {}
+
+
+def _clean_suggestions(value: Any) -> List[str]:
+    """Normalize a model-produced suggestion list to at most 3 non-empty strings."""
+    if not isinstance(value, list):
+        return []
+    return [str(x).strip() for x in value if str(x).strip()][:3]
+
+
+# --- Tool Registry for Python-side Execution (read-only; extend by editing this table) ---
+TOOL_REGISTRY: Mapping[str, Callable[[Dict[str, Any]], Any]] = MappingProxyType({
+    "nearest_nhs_services": tool_nearest_nhs_services,
+    "trigger_safety_protocol": tool_safety,
+    "onboarding": tool_onboarding,
+    "guided_search": guided_search,
+    "nhs_111_live_triage": nhs_111_live_triage,
+})
+
+
+# Process-wide TTL memo for pure lookups (seconds); safety and triage are never cached.
+# NHS GP/A&E listings for a postcode are effectively static over a day.
+TOOL_CACHE_TTLS = {"nearest_nhs_services": 86400, "guided_search": 600}
+_TOOL_CACHES = {name: TTLCache(maxsize=256, ttl=ttl) for name, ttl in TOOL_CACHE_TTLS.items()}
+_TOOL_CACHE_LOCK = threading.Lock()
+
+
+# Full UK postcode (outward + inward code) after normalize_postcode.
+UK_POSTCODE_RE = re.compile(r"[A-Z]{1,2}\d[A-Z\d]? ?\d[A-Z]{2}")
+
+
+def normalize_postcode(value: Any) -> str:
+    """Upper-case and collapse whitespace: "nw1  2bu " -> "NW1 2BU"."""
+    return " ".join(str(value or "").upper().split())
+
+
+def _nearest_cache_args(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Canonical lookup args, so "nw1 2bu" from onboarding and "NW1 2BU" from triage share an entry."""
+    return {
+        "postcode_full": normalize_postcode(arguments.get("postcode_full")),
+        "service_type": str(arguments.get("service_type") or "").strip().upper(),
+        "n": arguments.get("n", 3),
+    }
+
+
+# Cache-key normalizers per tool (defaults to the raw arguments).
+TOOL_CACHE_KEY_ARGS: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    "nearest_nhs_services": _nearest_cache_args,
+}
+
+
+def _is_cacheable_result(result: Any) -> bool:
+    """Only successful, non-empty payloads are memoised; parse fallbacks and errors retry next call."""
+    if not result:
+        return False
+    if isinstance(result, dict):
+        if "raw" in result or "error" in result:
+            return False
+        # guided_search with nothing found
+        if "context" in result and not str(result["context"]).strip():
+            return False
+    return True
 
 
-# --- Tool Registry for Python-side Execution ---
 def execute_tool(tool_name: str, arguments: Dict[str, Any]):
-    """Dispatch supported tool calls by name."""
-    if tool_name == "nearest_nhs_services":
-        return tool_nearest_nhs_services(arguments)
-    if tool_name == "trigger_safety_protocol":
-        return tool_safety(arguments)
-    if tool_name == "onboarding":
-        return tool_onboarding(arguments)
-    if tool_name == "guided_search":
-        return guided_search(arguments)
-    if tool_name == "nhs_111_live_triage":
-        return nhs_111_live_triage(arguments)
-    return f"[Error: Unknown tool '{tool_name}']"
+    """Dispatch supported tool calls by name, reusing recent results for cacheable tools."""
+    handler = TOOL_REGISTRY.get(tool_name)
+    if handler is None:
+        return f"[Error: Unknown tool '{tool_name}']"
+    cache = _TOOL_CACHES.get(tool_name)
+    if cache is None:
+        return handler(arguments)
+
+    key_args = TOOL_CACHE_KEY_ARGS.get(tool_name)
+    key = orjson.dumps(key_args(arguments) if key_args else arguments, option=orjson.OPT_SORT_KEYS, default=str)
+    with _TOOL_CACHE_LOCK:
+        cached = cache.get(key)
+    if cached is not None:
+        # callers get their own copy; the cached entry is shared across sessions
+        return copy.deepcopy(cached)
+    result = handler(arguments)
+    if _is_cacheable_result(result):
+        with _TOOL_CACHE_LOCK:
+            cache[key] = copy.deepcopy(result)
+    return result
+
+
+def parse_tool_arguments(raw_args: Any) -> Dict[str, Any]:
+    """Decode function-call arguments, tolerating malformed JSON."""
+    if isinstance(raw_args, str):
+        try:
+            return _loads(raw_args)
+        except Exception:
+            return {}
+    return raw_args or {}
+
+
+def nearest_lookup_args(tool_name: str, tool_result: Any) -> Optional[Dict[str, Any]]:
+    """Return nearest_nhs_services args when a final triage result asks for a lookup."""
+    if tool_name != "nhs_111_live_triage" or not isinstance(tool_result, dict):
+        return None
+    if (
+        tool_result.get("status") == "final"
+        and tool_result.get("should_lookup")
+        and tool_result.get("postcode_full")
+        and tool_result.get("suggested_service") in {"GP", "A&E"}
+    ):
+        return {
+            "postcode_full": tool_result.get("postcode_full", ""),
+            "service_type": tool_result.get("suggested_service"),
+            "n": 3,
+        }
+    return None
+
+
+def _response_tokens(resp: Any) -> int:
+    """Context size of a stored response (input + output tokens); 0 when usage is not reported."""
+    usage = getattr(resp, "usage", None)
+    if usage is None:
+        return 0
+    return (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "output_tokens", 0) or 0)
+
+
+def split_response_output(resp: Any) -> Tuple[List[Any], str]:
+    """One pass over a response's output items: (function calls, concatenated output text)."""
+    tool_calls: List[Any] = []
+    text_parts: List[str] = []
+    for item in resp.output:
+        if item.type == "function_call":
+            tool_calls.append(item)
+        elif item.type == "message":
+            text_parts.extend(part.text for part in item.content if part.type == "output_text")
+    return tool_calls, "".join(text_parts)
+
+
+def _has_tool_outputs(input_items: Any) -> bool:
+    """True if a request's input carries function_call_output items."""
+    return isinstance(input_items, list) and any(
+        isinstance(item, dict) and item.get("type") == "function_call_output" for item in input_items
+    )
+
+
+def tool_output_text(tool_result: Any) -> str:
+    """function_call_output payload for a tool result (strings pass through)."""
+    return tool_result if isinstance(tool_result, str) else _dumps(tool_result)
+
+
+# Per-tool caps on concurrent external calls (web search / NHS lookups) across all sessions.
+TOOL_CONCURRENCY = {"guided_search": 2, "nearest_nhs_services": 2, "nhs_111_live_triage": 2}
+_TOOL_SEMAPHORES = {name: threading.BoundedSemaphore(limit) for name, limit in TOOL_CONCURRENCY.items()}
+
+
+def _run_tool(tool_name: str, arguments: Dict[str, Any]) -> Tuple[Any, str]:
+    """Execute a tool and serialize its output on the same (worker) thread."""
+    semaphore = _TOOL_SEMAPHORES.get(tool_name)
+    if semaphore is None:
+        result = execute_tool(tool_name, arguments)
+    else:
+        with semaphore:
+            result = execute_tool(tool_name, arguments)
+    return result, tool_output_text(result)
+
+
+def _chained_lookup(lookup_args: Dict[str, Any]) -> Optional[str]:
+    """Run the triage -> nearest services lookup; failures are non-fatal."""
+    try:
+        return _run_tool("nearest_nhs_services", lookup_args)[1]
+    except Exception:
+        return None
+
+
+# Speculative prefetches get their own worker, so they never hold TOOL_EXECUTOR threads live rounds need.
+PREFETCH_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="agent-prefetch")
+
+
+def _prefetch_lookup(lookup_args: Dict[str, Any]) -> None:
+    """Warm the tool cache, skipped if live lookups hold every nearest_nhs_services slot."""
+    semaphore = _TOOL_SEMAPHORES["nearest_nhs_services"]
+    if not semaphore.acquire(blocking=False):
+        return
+    try:
+        execute_tool("nearest_nhs_services", lookup_args)
+    except Exception:
+        pass
+    finally:
+        semaphore.release()
+
+
+def prefetch_nearest_services(postcode: str) -> None:
+    """
+    Speculatively run the GP lookup a later triage hand-off would request, while the user is typing.
+    The result lands in the tool cache; nothing waits on it.
+    """
+    PREFETCH_EXECUTOR.submit(_prefetch_lookup, {"postcode_full": postcode, "service_type": "GP", "n": 3})
+
+
+def execute_tool_calls(
+    calls: List[Tuple[str, Dict[str, Any]]], chain_lookup: bool = False
+) -> Tuple[List[Tuple[Any, str]], Optional[int], Optional[str]]:
+    """
+    Execute (tool_name, arguments) pairs, returning (result, serialized output) in call order.
+    When chain_lookup is set, the first triage result that recommends GP/A&E
+    also triggers a nearest services lookup; returns (results, triage index, lookup output).
+    """
+    results: List[Any] = [None] * len(calls)
+    lookup_idx: Optional[int] = None
+
+    if not (PARALLEL_TOOLS and len(calls) > 1):
+        lookup = None
+        for idx, (name, args) in enumerate(calls):
+            results[idx] = _run_tool(name, args)
+            lookup_args = nearest_lookup_args(name, results[idx][0]) if chain_lookup and lookup_idx is None else None
+            if lookup_args:
+                lookup_idx, lookup = idx, _chained_lookup(lookup_args)
+        return results, lookup_idx, lookup
+
+    # Collect results as they complete so the chained lookup starts while
+    # slower sibling calls are still in flight.
+    pending = {TOOL_EXECUTOR.submit(_run_tool, name, args): idx for idx, (name, args) in enumerate(calls)}
+    lookup_future = None
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            idx = pending.pop(future)
+            results[idx] = future.result()
+            lookup_args = nearest_lookup_args(calls[idx][0], results[idx][0]) if chain_lookup and lookup_idx is None else None
+            if lookup_args:
+                lookup_idx = idx
+                lookup_future = TOOL_EXECUTOR.submit(_chained_lookup, lookup_args)
+    return results, lookup_idx, lookup_future.result() if lookup_future else None
 
 
 class AgentSession:
@@ -70,9 +543,23 @@ class AgentSession:
 
     def __init__(self, client_override: Optional[OpenAI] = None):
         self.client = client_override or client
-        self.conversation_history: List[Dict[str, str]] = []
+        if client_override is None:
+            # first turn then reuses a warm keep-alive connection instead of paying the handshake
+            prewarm_connection(self.client)
+        # Bounded transcript: the oldest turns drop off in O(1) once the cap is hit.
+        self.conversation_history: Deque[Dict[str, str]] = deque(maxlen=64)
+        # Rolling summary of turns that have scrolled out of the model window;
+        # counters are absolute message numbers so they survive deque eviction.
+        self.history_summary = ""
+        self._history_total = 0
+        self._summarized_upto = 0
+        # Absolute index where the model window starts; it jumps instead of sliding.
+        self._window_start = 0
+        # Server-side conversation state: the stored response the next turn can chain on.
+        self._last_response_id: Optional[str] = None
+        self._chained_turns = 0
         self.user_profile: Dict[str, Any] = {}
-        self.system_prompt = build_system_prompt(self.user_profile)
+        self._set_system_prompt()
 
         self.onboarding_active = False
         self.onboarding_spec: Optional[Dict[str, Any]] = None
@@ -84,62 +571,189 @@ class AgentSession:
         self.triage_question_count = 0
 
         self.prompt_suggestions: List[str] = []
+        self._suggestions_ready = False
+        self._last_reply = ""
+        # Per-session memo keyed on (profile JSON, reply prefix) to skip repeat LLM calls.
+        self._suggestions_for = lru_cache(maxsize=256)(self._request_prompt_suggestions)
 
         self.HISTORY_WINDOW = 15
+        self.SUMMARY_BATCH = 8
+        self.HISTORY_TOKEN_BUDGET = 6000
+        self.MAX_CHAINED_TURNS = 6
         self.MAX_OUT = 250
+        self.SYNTHESIS_MAX_OUT = 180
         self.MAX_TOOL_ROUNDS = 4
-        self.MAX_RETRIES = 2
+        self.MAX_RETRIES = 4
 
     # -----------------------------
     # SAFE MODEL CALL (TPM-aware)
     # -----------------------------
-    def safe_create(self, **kwargs):
-        """Call OpenAI with retries and trimmed history if rate limited."""
+    def safe_create(self, on_delta: Optional[Callable[[str], None]] = None, cacheable: bool = False, **kwargs):
+        """
+        Call OpenAI with retries, backoff and trimmed history if rate limited.
+        With on_delta, the response is streamed and each text delta is passed on as it arrives.
+        With cacheable, an identical earlier request that produced plain text is answered from memory.
+        Text-only calls (tool_choice="none") are sent without the tool schema to save prefill tokens,
+        except calls answering function calls: those keep it so the previous_response_id chain stays valid.
+        """
+        if kwargs.get("tool_choice") == "none" and not _has_tool_outputs(kwargs.get("input")):
+            kwargs.pop("tools", None)
+            kwargs.pop("tool_choice")
+        cache_key = _response_cache_key(kwargs) if cacheable else None
+        if cache_key:
+            cached = _cached_response(cache_key)
+            if cached is not None:
+                if on_delta is not None and cached.output_text:
+                    on_delta(cached.output_text)
+                return cached
+
+        last_exc: Optional[RateLimitError] = None
+        trimmed = False
         for attempt in range(self.MAX_RETRIES + 1):
             try:
-                return self.client.responses.create(**kwargs)
-            except RateLimitError:
-                if "input" in kwargs and isinstance(kwargs["input"], list):
-                    sys_and_pins = [x for x in kwargs["input"] if x.get("role") == "system"]
-                    others = [x for x in kwargs["input"] if x.get("role") != "system"]
-                    kwargs["input"] = sys_and_pins + others[-3:]
-                kwargs["max_output_tokens"] = min(kwargs.get("max_output_tokens", self.MAX_OUT), 150)
-                time.sleep(0.2)
-        raise
+                if on_delta is None:
+                    resp = self.client.responses.create(**kwargs)
+                else:
+                    with self.client.responses.stream(**kwargs) as stream:
+                        for event in stream:
+                            if event.type == "response.output_text.delta":
+                                on_delta(event.delta)
+                        resp = stream.get_final_response()
+                # a reply to the rate-limit-trimmed input must not answer the full request later
+                if cache_key and not trimmed:
+                    _remember_response(cache_key, resp)
+                return resp
+            except RateLimitError as exc:
+                last_exc = exc
+                if attempt == self.MAX_RETRIES:
+                    break
+                # Header-guided waits usually clear the limit; only shrink the request if the
+                # second retry is also limited. Trim once: later retries reuse the trimmed input.
+                # Only the oldest conversation messages go: system pins stay, and function_call_output
+                # items (no role) must all be sent or the chained call_ids are left unanswered.
+                if attempt >= 1 and not trimmed and isinstance(kwargs.get("input"), list):
+                    messages = [item for item in kwargs["input"] if item.get("role") not in (None, "system")]
+                    kept = {id(item) for item in messages[-3:]}
+                    kwargs["input"] = [
+                        item for item in kwargs["input"] if item.get("role") in (None, "system") or id(item) in kept
+                    ]
+                    trimmed = True
+                    kwargs["max_output_tokens"] = min(kwargs.get("max_output_tokens", self.MAX_OUT), 150)
+                time.sleep(retry_delay(exc, attempt))
+        raise last_exc
+
+    def _reset_response_chain(self) -> None:
+        """Next turn resends the history window (the server chain no longer matches the transcript)."""
+        self._last_response_id = None
+        self._chained_turns = 0
+
+    def _set_system_prompt(self) -> None:
+        """Rebuild the system prompt (and its reusable input message) from the current profile."""
+        self.system_prompt = build_system_prompt(self.user_profile)
+        self.system_message = {"role": "system", "content": self.system_prompt}
+
+    def _append_history(self, role: str, content: str) -> None:
+        """Record a transcript message (shown in the UI; the tail is sent to the model)."""
+        self.conversation_history.append({"role": role, "content": content})
+        self._history_total += 1
+        # Expand the window to 2x HISTORY_WINDOW, then jump its start forward by HISTORY_WINDOW:
+        # between jumps every request is the previous one plus new messages (a prompt-cache hit).
+        if self._history_total - self._window_start >= 2 * self.HISTORY_WINDOW:
+            self._window_start = self._history_total - self.HISTORY_WINDOW
+
+    def _maybe_summarize(self) -> None:
+        """
+        Fold messages that have left the model window into history_summary, a batch at a time.
+        On failure the summary is left as is and the batch is retried next turn.
+        """
+        window_start = self._window_start
+        if window_start - self._summarized_upto < self.SUMMARY_BATCH:
+            return
+        offset = self._history_total - len(self.conversation_history)
+        start = max(self._summarized_upto - offset, 0)
+        stale = islice(self.conversation_history, start, window_start - offset)
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in stale)
+        prompt = (
+            "Summarize the following dialogue in at most 120 tokens for an NHS navigation assistant. "
+            "Preserve user profile facts, symptoms and answers already given, and the current onboarding/triage state.\n\n"
+            f"Existing summary: {self.history_summary or '(none)'}\n\n"
+            f"New dialogue:\n{transcript}"
+        )
+        try:
+            resp = self.client.responses.create(model="gpt-4o-mini", input=prompt, max_output_tokens=160)
+        except Exception:
+            return
+        summary = (resp.output_text or "").strip()
+        if summary:
+            self.history_summary = summary
+            self._summarized_upto = window_start
+
+    def _summary_context(self) -> List[Dict[str, str]]:
+        """System message carrying the rolling summary, if there is one."""
+        if not self.history_summary:
+            return []
+        return [{"role": "system", "content": "Prior conversation summary: " + self.history_summary}]
+
+    def _history_window(self) -> List[Dict[str, str]]:
+        """
+        Return the messages from the window start (HISTORY_WINDOW to 2x HISTORY_WINDOW of them),
+        dropping the oldest non-system ones while the request would exceed HISTORY_TOKEN_BUDGET.
+        The latest message is always kept.
+        """
+        offset = self._history_total - len(self.conversation_history)
+        start = max(self._window_start - offset, 0)
+        window = list(islice(self.conversation_history, start, None))
+
+        budget = self.HISTORY_TOKEN_BUDGET - count_tokens(self.system_prompt) - count_tokens(self.history_summary)
+        total = sum(count_tokens(message["content"]) for message in window)
+        idx = dropped = 0
+        while total > budget and idx < len(window) - 1:
+            if window[idx]["role"] == "system":
+                idx += 1
+                continue
+            total -= count_tokens(window.pop(idx)["content"])
+            dropped += 1
+        if dropped:
+            logger.info("Trimmed %d history messages to fit the %d-token budget", dropped, self.HISTORY_TOKEN_BUDGET)
+        return window
 
     def _update_state_from_tool(self, tool_name: str, tool_result: Any):
         """Integrate tool outputs into onboarding/triage state tracking."""
+        # every real tool returns a dict; the unknown-tool error string carries no state
+        if not isinstance(tool_result, dict):
+            return None
+        mode = tool_result.get("mode")
+        status = tool_result.get("status")
+
         # onboarding activation
-        if isinstance(tool_result, dict) and tool_result.get("mode") == "llm_multiturn_onboarding":
+        if mode == "llm_multiturn_onboarding":
             self.onboarding_active = True
             self.onboarding_spec = tool_result
+            questions = tool_result.get("questions", [])
+            question_iter = iter(questions)
             self.onboarding_state = {
-                "questions": tool_result.get("questions", []),
+                "questions": questions,
+                "question_iter": question_iter,
+                "current": next(question_iter, None),
                 "current_idx": 0,
-                "answers": {},
+                # preseeded in question order, so it doubles as the finished profile
+                "answers": dict.fromkeys(q.get("key") for q in questions),
                 "expecting_answer": False,
                 "reprompted": False,
             }
             self.triage_active = False
 
         # triage tracking
-        parsed = None
-        try:
-            parsed = tool_result if isinstance(tool_result, dict) else json.loads(tool_result)
-        except Exception:
-            parsed = None
-
-        if isinstance(parsed, dict):
-            if parsed.get("status") == "need_more_info":
-                self.triage_active = True
-                self.triage_known_answers.update(parsed.get("known_answers_update", {}))
-                self.triage_question_count = self.triage_question_count + 1
-            elif parsed.get("status") == "final":
-                self.triage_active = False
-                self.triage_known_answers = {}
-                self.triage_question_count = 0
+        if status == "need_more_info":
+            self.triage_active = True
+            self.triage_known_answers.update(tool_result.get("known_answers_update", {}))
+            self.triage_question_count = self.triage_question_count + 1
+        elif status == "final":
+            self.triage_active = False
+            self.triage_known_answers = {}
+            self.triage_question_count = 0
 
-        return parsed
+        return tool_result
 
     # -----------------------------
     # ONBOARDING HELPERS
@@ -148,11 +762,7 @@ class AgentSession:
         """Return the current onboarding question or None if finished."""
         if not self.onboarding_state:
             return None
-        idx = self.onboarding_state.get("current_idx", 0)
-        questions = self.onboarding_state.get("questions") or []
-        if idx >= len(questions):
-            return None
-        return questions[idx]
+        return self.onboarding_state.get("current")
 
     def _prompt_next_onboarding_question(self) -> str:
         """Set expectation flag and surface the next onboarding question text."""
@@ -168,17 +778,15 @@ class AgentSession:
         text = (raw or "").strip()
         if text == "":
             return None, True
-        lowered = text.lower()
-        if lowered in {"skip", "prefer not to say", "n/a", "na"}:
+        # real answers are usually longer than any skip token: no lowercase copy needed
+        if len(text) <= SKIP_TOKEN_MAX_LEN and text.lower() in SKIP_TOKENS:
             return None, False
         return text, False
 
     def _finalize_onboarding_flow(self) -> str:
         """Persist profile, add deterministic eligibility summary, and close onboarding."""
-        questions = self.onboarding_state.get("questions") if self.onboarding_state else []
-        answers = self.onboarding_state.get("answers") if self.onboarding_state else {}
-        profile = {q.get("key"): answers.get(q.get("key")) for q in (questions or [])}
-        profile_json = json.dumps(profile)
+        profile = dict(self.onboarding_state.get("answers") or {}) if self.onboarding_state else {}
+        profile_json = _dumps(profile)
         completion_note = "Onboarding is complete. I have saved these details for future chats."
         eligibility = self._eligibility_summary_from_profile(profile)
         summary = f"{completion_note}\n\n{eligibility}" if eligibility else completion_note
@@ -191,8 +799,8 @@ class AgentSession:
         postcode = profile.get("postcode") or ""
         gp_registered = str(profile.get("gp_registered") or "").lower()
 
-        long_stay = any(k in stay for k in ["year", "yr", "6", "twelve", "12", "long", "permanent", "settled"])
-        has_uk_status = any(k in visa for k in ["student", "work", "skilled", "settled", "ilr", "british", "uk"])
+        long_stay = bool(LONG_STAY_RE.search(stay))
+        has_uk_status = bool(UK_STATUS_RE.search(visa))
         has_address = bool(postcode.strip())
 
         gp_line = (
@@ -201,19 +809,11 @@ class AgentSession:
             if long_stay or has_uk_status
             else "May be asked about length of stay for GP registration; urgent/111/A&E are still available."
         )
-        urgent_line = "Urgent and emergency care (NHS 111, A&E) are available regardless of GP registration."
-        registered_note = "You already have a GP registered." if "yes" in gp_registered else ""
-        location_note = f"Postcode on file: {postcode}" if postcode else ""
-
-        return "\n".join(
-            [
-                "Based on your details, here are likely options:",
-                f"- {gp_line}",
-                f"- {urgent_line}",
-                f"- {registered_note}".strip(" -"),
-                f"- {location_note}".strip(" -"),
-                "If you'd like, I can look up nearby GP practices or urgent care options.",
-            ]
+        registered_note = "\n- You already have a GP registered." if "yes" in gp_registered else ""
+        location_note = f"\n- Postcode on file: {postcode}" if postcode else ""
+
+        return ELIGIBILITY_TEMPLATE.format_map(
+            {"gp": gp_line, "registered": registered_note, "location": location_note}
         )
 
     # -----------------------------
@@ -261,6 +861,15 @@ class AgentSession:
         self.triage_state["answers"][key] = user_input.strip()
         self.triage_state["idx"] = idx + 1
 
+    def _triage_fallback_question(self) -> Optional[str]:
+        """Templated follow-up on up to three triage topics not yet in known_answers (None if all covered)."""
+        known = " ".join(self.triage_known_answers).lower()
+        missing = [phrase for key, phrase in TRIAGE_FALLBACK_TOPICS if key not in known][:3]
+        if not missing:
+            return None
+        asks = missing[0] if len(missing) == 1 else "; ".join(missing[:-1]) + "; and " + missing[-1]
+        return f"Could you tell me a bit more about {asks}?"
+
     def _triage_summary(self) -> str:
         """Summarize triage inputs, suggest routing, and offer postcode-based lookup."""
         answers = (self.triage_state or {}).get("answers", {})
@@ -271,16 +880,10 @@ class AgentSession:
         other = answers.get("other", "")
         postcode = (self.user_profile or {}).get("postcode") or ""
 
-        def has_yes(text):
-            return any(token in text for token in ["yes", "y", "true", "1"])
-
-        red_flagged = has_yes(red_flags)
-        severe = False
-        try:
-            severe = float(severity) >= 8
-        except Exception:
-            severe = False
-        dehydrated = any(k in fluids for k in ["no", "not", "can't", "cannot", "unable"])
+        red_flagged = YES_RE.search(red_flags) is not None
+        severity_match = NUM_RE.search(severity)
+        severe = bool(severity_match and float(severity_match.group()) >= 8)
+        dehydrated = DEHYDRATED_RE.search(fluids) is not None
 
         if red_flagged:
             recommended_service = "A&E"
@@ -308,17 +911,17 @@ class AgentSession:
             else f"I can look up the nearest {recommended_service} options if you share your postcode."
         )
 
-        summary = (
-            "Thanks, here's a quick triage summary (following NHS 111 style steps):\n"
-            f"- Severity: {severity or 'not given'}\n"
-            f"- Fluids: {answers.get('fluids', 'not given')}\n"
-            f"- Onset: {onset or 'not given'}\n"
-            f"- Red flags: {answers.get('red_flags', 'not given')}\n"
-            f"- Other: {other or 'not given'}\n\n"
-            f"{route}\n"
-            f"{postcode_note} If you want, I can also help with GP registration or local services."
+        return TRIAGE_SUMMARY_TEMPLATE.format_map(
+            {
+                "severity": severity or "not given",
+                "fluids": answers.get("fluids", "not given"),
+                "onset": onset or "not given",
+                "red_flags": answers.get("red_flags", "not given"),
+                "other": other or "not given",
+                "route": route,
+                "postcode_note": postcode_note,
+            }
         )
-        return summary
 
     def _handle_onboarding_answer(self, user_input: str) -> str:
         if not self.onboarding_state:
@@ -337,6 +940,7 @@ class AgentSession:
         # store answer (None allowed for skips/empty after reprompt)
         self.onboarding_state["answers"][question.get("key")] = answer
         self.onboarding_state["current_idx"] += 1
+        self.onboarding_state["current"] = next(self.onboarding_state["question_iter"], None)
         self.onboarding_state["expecting_answer"] = False
         self.onboarding_state["reprompted"] = False
 
@@ -347,103 +951,85 @@ class AgentSession:
 
     def _process_final_reply(self, agent_reply: str) -> str:
         agent_reply = self._ensure_useful_links(agent_reply)
-        clean_reply = strip_profile_tag(agent_reply)
-        self.conversation_history.append({"role": "assistant", "content": clean_reply})
+        maybe_profile, clean_reply = split_profile(agent_reply)
+        self._append_history("assistant", clean_reply)
 
-        maybe_profile = extract_profile(agent_reply)
         if maybe_profile:
             self.user_profile = maybe_profile
-            self.system_prompt = build_system_prompt(self.user_profile)
+            self._set_system_prompt()
 
-            # reset modes
+            # reset modes (and the server chain, which still carries the old system prompt)
+            self._reset_response_chain()
             self.onboarding_active = False
             self.onboarding_spec = None
             self.onboarding_state = None
             self.triage_active = False
             self.triage_known_answers = {}
+            # no profile echo in history: the rebuilt system prompt already carries it every request
 
-            self.conversation_history.append(
-                {
-                    "role": "system",
-                    "content": f"Updated user profile for memory:\n{self.user_profile}",
-                }
-            )
+            # the lookup is a paid web search: skip area-only or refused answers ("NW1", "Camden", "skip")
+            postcode = normalize_postcode(self.user_profile.get("postcode"))
+            if UK_POSTCODE_RE.fullmatch(postcode):
+                prefetch_nearest_services(postcode)
 
-            follow_up = self._profile_followups()
+            follow_up = self._generate_ui_extras(clean_reply)
             if follow_up:
-                self.conversation_history.append({"role": "assistant", "content": follow_up})
+                self._append_history("assistant", follow_up)
                 clean_reply = clean_reply + "\n\n" + follow_up
 
+        self._last_reply = clean_reply
         return clean_reply
 
     def _ensure_useful_links(self, agent_reply: str) -> str:
         """
         Post-process assistant text to ensure common Useful links are concrete NHS URLs.
         """
-        if "Useful links" not in agent_reply:
-            return agent_reply
-
-        lines = agent_reply.splitlines()
-        if not any(line.strip().lower().startswith("useful links") for line in lines):
+        match = USEFUL_LINKS_HEADER_RE.search(agent_reply)
+        if not match:
             return agent_reply
+        blank = BLANK_LINE_RE.search(agent_reply, match.end())
+        end = blank.start() if blank else len(agent_reply)
+        return agent_reply[: match.start()] + USEFUL_LINKS_SECTION + agent_reply[end:]
 
-        canonical_links = [
-            ("Find a GP", "https://www.nhs.uk/service-search/find-a-gp"),
-            ("Register with a GP", "https://www.nhs.uk/nhs-services/gps/how-to-register-with-a-gp-surgery/"),
-            ("Use NHS 111 online", "https://111.nhs.uk/"),
-            ("NHS services guide", "https://www.nhs.uk/using-the-nhs/nhs-services/"),
-            ("LBS health and wellbeing", "https://www.london.edu/masters-experience/student-support"),
-            ("LBS mental wellbeing support", "https://www.london.edu/masters-experience/student-support/mental-health"),
-        ]
-
-        new_section = ["Useful links", *[f"- {title}: {url}" for title, url in canonical_links]]
-
-        rebuilt = []
-        idx = 0
-        replaced = False
-        while idx < len(lines):
-            line = lines[idx]
-            if not replaced and line.strip().lower().startswith("useful links"):
-                # skip old section
-                idx += 1
-                while idx < len(lines) and lines[idx].strip() != "":
-                    idx += 1
-                rebuilt.extend(new_section)
-                replaced = True
-                continue
-            rebuilt.append(line)
-            idx += 1
-
-        return "\n".join(rebuilt)
-
-    def _profile_followups(self) -> str:
+    def _generate_ui_extras(self, last_reply: str) -> str:
+        """
+        Single model call for profile follow-ups and next-prompt suggestions.
+        Stores the suggestions on prompt_suggestions and returns the follow-up text.
+        """
         if not self.user_profile:
             return ""
 
         prompt = (
-            "Using the profile below, propose 3-5 concise follow-up suggestions tailored to the user. "
+            "Using the profile and last assistant reply below, return ONLY a JSON object with two keys.\n"
+            '"followups": one string with 3-5 concise follow-up suggestions tailored to the user. '
             "Keep it short (under ~120 words), use numbered bullets, and stay within wellbeing/health navigation "
             "topics relevant to UK NHS care. Do NOT ask for onboarding details again. "
-            "End with a brief invitation to ask for help finding local services if relevant.\n\n"
-            f"User profile: {json.dumps(self.user_profile)}"
+            "End with a brief invitation to ask for help finding local services if relevant.\n"
+            '"suggestions": a list of 3 short follow-up prompts the user might want to ask next, '
+            "each under 80 characters, no duplicates.\n\n"
+            f"User profile: {_dumps(self.user_profile)}\n"
+            f"Last assistant reply: {last_reply}"
         )
 
+        followups = ""
+        suggestions: List[str] = []
+        request = {"model": "gpt-4o-mini", "input": prompt, "max_output_tokens": 320}
+        # Same profile and reply (e.g. a repeated onboarding) -> reuse the earlier extras.
+        cache_key = _response_cache_key(request)
         try:
-            resp = self.client.responses.create(
-                model="gpt-4o-mini",
-                input=prompt,
-                max_output_tokens=220,
-            )
-            return resp.output_text or ""
+            resp = _cached_response(cache_key) or self.client.responses.create(**request)
+            parsed = _parse_json_object(resp.output_text or "")
+            if isinstance(parsed, dict):
+                followups = str(parsed.get("followups") or "").strip()
+                suggestions = _clean_suggestions(parsed.get("suggestions"))
+                if followups and suggestions:
+                    _remember_response(cache_key, resp)
         except Exception:
-            fallback = (
-                "Here are a few next steps you might find useful:\n"
-                "1) Find nearby GP practices and register.\n"
-                "2) Book a routine health check or vaccination if due.\n"
-                "3) Explore local mental wellbeing resources.\n"
-                "If you want, I can look up nearby services based on your postcode."
-            )
-            return fallback
+            pass
+
+        self.prompt_suggestions = suggestions or list(FALLBACK_PROMPT_SUGGESTIONS)
+        self._suggestions_ready = True
+        return followups or PROFILE_FOLLOWUPS_FALLBACK
 
     def _eligibility_response(self) -> str:
         """
@@ -460,43 +1046,60 @@ class AgentSession:
             "Want me to confirm with your details? I can start onboarding now to collect postcode, visa/status, UK stay length, and GP status, then I'll summarise what you're eligible for. Just say 'onboarding' to begin."
         )
 
+    @property
+    def prompt_suggestions_ready(self) -> bool:
+        """True once suggestions for the latest reply exist, so showing them needs no model call."""
+        return self._suggestions_ready
+
+    def get_prompt_suggestions(self) -> List[str]:
+        """
+        Next-prompt suggestions for the latest reply, generated on first request rather than every turn.
+        Profile-completion turns already have them from _generate_ui_extras.
+        """
+        if not self._suggestions_ready:
+            self.prompt_suggestions = self._generate_prompt_suggestions(self._last_reply)
+            self._suggestions_ready = True
+        return list(self.prompt_suggestions)
+
     def _generate_prompt_suggestions(self, last_reply: str) -> List[str]:
+        """Return next-prompt suggestions, reusing cached results for repeat inputs."""
+        profile_key = orjson.dumps(self.user_profile, option=orjson.OPT_SORT_KEYS).decode()
+        try:
+            return list(self._suggestions_for(profile_key, last_reply[:200]))
+        except Exception:
+            # Fallback generic suggestions if LLM parsing fails (failures are not cached)
+            return list(FALLBACK_PROMPT_SUGGESTIONS)
+
+    def _request_prompt_suggestions(self, profile_key: str, reply_key: str) -> Tuple[str, ...]:
+        """Ask the model for suggestions; raises if nothing usable comes back."""
         prompt = (
             "Generate 3 short follow-up prompts the user might want to ask next. "
             "Keep each under 80 characters. "
             "Return ONLY a JSON list of strings. "
             "Avoid duplicates. "
-            f"User profile: {json.dumps(self.user_profile)}. "
-            f"Last assistant reply: {last_reply}"
+            f"User profile: {profile_key}. "
+            f"Last assistant reply: {reply_key}"
         )
-        try:
-            resp = self.client.responses.create(
-                model="gpt-4o-mini",
-                input=prompt,
-                max_output_tokens=120,
-            )
-            raw = resp.output_text or "[]"
-            parsed = json.loads(raw)
-            if isinstance(parsed, list):
-                cleaned = [str(x).strip() for x in parsed if str(x).strip()]
-                if cleaned:
-                    return cleaned[:3]
-        except Exception:
-            pass
-
-        # Fallback generic suggestions if LLM parsing fails
-        fallback = [
-            "Find nearby GP or A&E",
-            "How to register with a GP",
-            "What to do for my symptoms now",
-        ]
-        return fallback
+        resp = self.client.responses.create(
+            model="gpt-4o-mini",
+            input=prompt,
+            max_output_tokens=120,
+        )
+        cleaned = _clean_suggestions(_parse_json_list(resp.output_text or ""))
+        if not cleaned:
+            raise ValueError("No usable prompt suggestions returned")
+        return tuple(cleaned)
 
-    def step(self, user_input: str) -> str:
+    def step(self, user_input: str, on_delta: Optional[Callable[[str], None]] = None) -> str:
         """
         Process a single user turn and return the assistant reply (profile tags stripped).
+        If on_delta is given, model text is streamed to it while the reply is generated;
+        the returned reply is the post-processed final text.
         """
-        self.conversation_history.append({"role": "user", "content": user_input})
+        self._append_history("user", user_input)
+        self._suggestions_ready = False
+        # Deterministic replies below never reach the server-side chain.
+        last_response_id, self._last_response_id = self._last_response_id, None
 
         # -------------------------------
         # SHORT-CIRCUIT: ACTIVE ONBOARDING
@@ -510,106 +1113,138 @@ class AgentSession:
             reply = self._handle_onboarding_answer(user_input)
             return self._process_final_reply(reply)
 
+        # -------------------------------
+        # SHORT-CIRCUIT: EMERGENCY RED FLAGS
+        # -------------------------------
+        # The prompt routes these to trigger_safety_protocol anyway; skip the model's TTFT.
+        # Mid-triage answers go to the triage tool, which weighs red flags against known_answers.
+        if not self.triage_active and is_emergency_message(user_input):
+            return self._process_final_reply(execute_tool("trigger_safety_protocol", {"message": user_input}))
+
+        # -------------------------------
+        # SHORT-CIRCUIT: EXPLICIT ONBOARDING REQUEST
+        # -------------------------------
+        # Same path as the model calling onboarding(), minus the round trip to pick the tool.
+        if ONBOARDING_TRIGGER_RE.fullmatch(user_input.strip().rstrip(".!")):
+            self._update_state_from_tool("onboarding", execute_tool("onboarding", {}))
+            self._chained_turns = 0
+            return self._process_final_reply(self._prompt_next_onboarding_question())
+
         # -------------------------------
         # SHORT-CIRCUIT: ELIGIBILITY QUERY
         # -------------------------------
-        lower_input = user_input.lower()
-        if "eligible" in lower_input or "eligibility" in lower_input:
+        if ELIGIBILITY_RE.search(user_input):
             reply = self._eligibility_response()
             return self._process_final_reply(reply)
 
         # -------------------------------
-        # PINNED CONTEXT (short!)
+        # MODE NOTES (short!)
         # -------------------------------
-        pinned = []
-
-        if self.onboarding_active and self.onboarding_spec is not None:
-            pinned.append(
-                {
-                    "role": "system",
-                    "content": (
-                        "ONBOARDING MODE IS ACTIVE. "
-                        "Ask the next onboarding question verbatim, in order. "
-                        "Do NOT start triage or search during onboarding."
-                    ),
-                }
-            )
+        # Carried on the latest user message instead of extra system messages, so the
+        # system prompt and earlier turns stay a byte-identical prefix for prompt caching.
+        # (Onboarding never gets here: it is fully deterministic via the short-circuit above.)
+        mode_notes = []
 
         if self.triage_active:
-            pinned.append(
-                {
-                    "role": "system",
-                    "content": (
-                        "TRIAGE MODE IS ACTIVE. "
-                        "Do NOT call onboarding unless user explicitly says 'onboarding'. "
-                        f"Use nhs_111_live_triage with known_answers={json.dumps(self.triage_known_answers)}. "
-                        "Ask only triage follow-up questions until triage status='final'. "
-                        "Do NOT repeat topics already in known_answers (e.g., severity, onset, injury/trauma, functional ability, red flags already covered). "
-                        f"You have already asked {self.triage_question_count} follow-ups. "
-                        "Tailor follow-ups to the presenting issue, keep them concise, aim to finish within 5-8 questions, and NEVER exceed 10; if you already have 5 answers or 5 questions asked, move to a final decision."
-                    ),
-                }
+            mode_notes.append(
+                TRIAGE_MODE_NOTE_TEMPLATE.format(
+                    known_answers=_dumps(self.triage_known_answers), asked=self.triage_question_count
+                )
             )
 
+        history = self._history_window()
+        if mode_notes and history and history[-1].get("role") == "user":
+            # copy: the UI transcript keeps the user's own words
+            history[-1] = {
+                "role": "user",
+                "content": "[MODE NOTES] " + " ".join(mode_notes) + "\n\n" + history[-1]["content"],
+            }
+
         # -------------------------------
         # FIRST MODEL CALL
         # -------------------------------
-        resp = self.safe_create(
-            model="gpt-4o-mini",
-            store=True,
-            input=[{"role": "system", "content": self.system_prompt}, *pinned, *self.conversation_history[-self.HISTORY_WINDOW :]],
-            tools=tools,
-            tool_choice="auto",
-            max_output_tokens=self.MAX_OUT,
-        )
+        resp = None
+        # Chain on last turn's stored response and send only the new user message; the chain is
+        # restarted from the history window every MAX_CHAINED_TURNS, or sooner past HISTORY_TOKEN_BUDGET.
+        if last_response_id and self._chained_turns < self.MAX_CHAINED_TURNS:
+            try:
+                resp = self.safe_create(
+                    on_delta=on_delta,
+                    model="gpt-4o-mini",
+                    store=True,
+                    previous_response_id=last_response_id,
+                    input=history[-1:],
+                    tools=tools,
+                    tool_choice="auto",
+                    max_output_tokens=self.MAX_OUT,
+                )
+                self._chained_turns += 1
+            except (BadRequestError, NotFoundError):
+                resp = None  # expired or rejected id: fall back to the full window
+
+        if resp is None:
+            self._maybe_summarize()
+            # Only an unchained opening call is cacheable: every other call carries a unique previous_response_id.
+            resp = self.safe_create(
+                on_delta=on_delta,
+                cacheable=True,
+                model="gpt-4o-mini",
+                store=True,
+                input=[
+                    self.system_message,
+                    *self._summary_context(),
+                    *history,
+                ],
+                tools=tools,
+                tool_choice="auto",
+                max_output_tokens=self.MAX_OUT,
+            )
+            self._chained_turns = 1
 
         final_response = resp
         triage_called_this_turn = False
         tool_rounds = 0
         bailed_with_unresolved_calls = False
         triage_lookup_done = False
+        # Fast path: a plain text reply (the common case) never enters the tool loop.
+        tool_calls, reply_text = split_response_output(final_response)
 
         # -------------------------------
         # BATCH TOOL HANDLING LOOP
         # -------------------------------
-        while True:
+        while tool_calls:
             tool_rounds += 1
             if tool_rounds > self.MAX_TOOL_ROUNDS:
                 bailed_with_unresolved_calls = True
                 break
 
-            tool_calls = [item for item in final_response.output if item.type == "function_call"]
-            if not tool_calls:
-                break
-
             # Guard: only one triage call per user turn
             if triage_called_this_turn and all(call.name == "nhs_111_live_triage" for call in tool_calls):
                 bailed_with_unresolved_calls = True
                 break
 
-            outputs = [{"role": "system", "content": self.system_prompt}]
+            # The system prompt is already part of the stored response chain
+            # (previous_response_id), so only the tool outputs are sent.
+            outputs = []
+            triage_final = False
 
-            for call in tool_calls:
+            # Tools are I/O bound and independent; state updates stay serial below.
+            tool_results, lookup_idx, lookup = execute_tool_calls(
+                [(call.name, parse_tool_arguments(call.arguments)) for call in tool_calls],
+                chain_lookup=not triage_lookup_done,
+            )
+
+            # Outputs come back already serialized from the worker threads.
+            for idx, (call, (tool_result, tool_output_str)) in enumerate(zip(tool_calls, tool_results)):
                 tool_name = call.name
                 call_id = call.call_id
-                raw_args = call.arguments
-
-                if isinstance(raw_args, str):
-                    try:
-                        args = json.loads(raw_args)
-                    except Exception:
-                        args = {}
-                else:
-                    args = raw_args or {}
-
-                tool_result = execute_tool(tool_name, args)
 
                 if tool_name == "nhs_111_live_triage":
                     triage_called_this_turn = True
 
-                parsed_tool = self._update_state_from_tool(tool_name, tool_result)
-
-                tool_output_str = tool_result if isinstance(tool_result, str) else json.dumps(tool_result)
+                state = self._update_state_from_tool(tool_name, tool_result)
+                if tool_name == "nhs_111_live_triage" and state and state.get("status") == "final":
+                    triage_final = True
 
                 outputs.append(
                     {
@@ -620,42 +1255,29 @@ class AgentSession:
                 )
 
                 # Auto-chain to nearest services when triage recommends GP or A&E and has a postcode.
-                if (
-                    tool_name == "nhs_111_live_triage"
-                    and not triage_lookup_done
-                    and isinstance(parsed_tool, dict)
-                    and parsed_tool.get("status") == "final"
-                    and parsed_tool.get("should_lookup")
-                    and parsed_tool.get("postcode_full")
-                    and parsed_tool.get("suggested_service") in {"GP", "A&E"}
-                ):
-                    try:
-                        lookup = tool_nearest_nhs_services(
-                            {
-                                "postcode_full": parsed_tool.get("postcode_full", ""),
-                                "service_type": parsed_tool.get("suggested_service"),
-                                "n": 3,
-                            }
-                        )
-                        outputs.append(
-                            {
-                                "type": "function_call_output",
-                                "call_id": f"{call_id}__nearest_services",
-                                "output": lookup if isinstance(lookup, str) else json.dumps(lookup),
-                            }
-                        )
-                        triage_lookup_done = True
-                    except Exception:
-                        pass
-
+                if idx == lookup_idx and lookup is not None:
+                    outputs.append(
+                        {
+                            "type": "function_call_output",
+                            "call_id": f"{call_id}__nearest_services",
+                            "output": lookup,
+                        }
+                    )
+                    triage_lookup_done = True
+
+            # A final triage decision (plus any chained lookup) only needs summarising:
+            # no further tool sampling and a tighter output cap.
             final_response = self.safe_create(
+                # Text after an onboarding activation is replaced by the scripted question.
+                on_delta=None if self.onboarding_active else on_delta,
                 model="gpt-4o-mini",
                 previous_response_id=final_response.id,
                 input=outputs,
                 tools=tools,
-                tool_choice="auto",
-                max_output_tokens=self.MAX_OUT,
+                tool_choice="none" if triage_final else "auto",
+                max_output_tokens=self.SYNTHESIS_MAX_OUT if triage_final else self.MAX_OUT,
             )
+            tool_calls, reply_text = split_response_output(final_response)
 
             # If onboarding just became active, break early and handle questions deterministically.
             if self.onboarding_active and self.onboarding_state:
@@ -664,17 +1286,20 @@ class AgentSession:
         # -------------------------------
         # FINAL TEXT RESPONSE
         # -------------------------------
-        agent_reply = final_response.output_text or ""
+        agent_reply = reply_text
+        # the stored response the next turn may chain on (None: resend the history window)
+        chain_resp: Optional[Any] = final_response
 
         # If unresolved tool calls, force text-only reply
         if bailed_with_unresolved_calls:
             forced = self.safe_create(
+                on_delta=on_delta,
                 model="gpt-4o-mini",
                 store=True,
                 input=[
-                    {"role": "system", "content": self.system_prompt},
-                    *pinned,
-                    *self.conversation_history[-self.HISTORY_WINDOW :],
+                    self.system_message,
+                    *self._summary_context(),
+                    *history,
                     {
                         "role": "system",
                         "content": (
@@ -690,37 +1315,57 @@ class AgentSession:
                 max_output_tokens=200,
             )
             agent_reply = forced.output_text or ""
-
-        # Blank-response fix
-        elif agent_reply.strip() == "":
-            forced = self.safe_create(
-                model="gpt-4o-mini",
-                previous_response_id=final_response.id,
-                input=[
-                    {
-                        "role": "system",
-                        "content": (
-                            self.system_prompt
-                            + "\n\nYou MUST respond to the user now in plain text. "
-                            "Do NOT call any tools. "
-                            "If triage is incomplete, ask the next 1–3 triage follow-up questions. "
-                            "If triage is complete, give routing and next steps."
-                        ),
-                    }
-                ],
-                tools=tools,
-                tool_choice="none",
-                max_output_tokens=200,
-            )
-            agent_reply = forced.output_text or ""
+            # a fresh chain rooted at the history window
+            chain_resp, self._chained_turns = forced, 1
+
+        # Blank-response fix: onboarding re-asks its scripted question below and
+        # triage can ask a templated follow-up, so only the generic case pays a model call.
+        elif agent_reply.strip() == "" and not (self.onboarding_active and self.onboarding_state):
+            fallback = self._triage_fallback_question() if self.triage_active else None
+            if fallback:
+                if on_delta is not None:
+                    on_delta(fallback)
+                agent_reply = fallback
+                chain_resp = None
+            else:
+                forced = self.safe_create(
+                    on_delta=on_delta,
+                    model="gpt-4o-mini",
+                    previous_response_id=final_response.id,
+                    input=[
+                        {
+                            "role": "system",
+                            "content": (
+                                self.system_prompt
+                                + "\n\nYou MUST respond to the user now in plain text. "
+                                "Do NOT call any tools. "
+                                "If triage is incomplete, ask the next 1–3 triage follow-up questions. "
+                                "If triage is complete, give routing and next steps."
+                            ),
+                        }
+                    ],
+                    tools=tools,
+                    tool_choice="none",
+                    max_output_tokens=200,
+                )
+                agent_reply = forced.output_text or ""
+                chain_resp = forced
 
         # Onboarding deterministic hand-off after tool activation
         if self.onboarding_active and self.onboarding_state:
             agent_reply = self._prompt_next_onboarding_question()
+            chain_resp = None
+
+        # The server re-bills the whole chain (tool outputs included) on every chained turn, so once
+        # it outgrows HISTORY_TOKEN_BUDGET the next turn restarts from the trimmed history window.
+        if chain_resp is not None and _response_tokens(chain_resp) > self.HISTORY_TOKEN_BUDGET:
+            chain_resp = None
 
-        clean = self._process_final_reply(agent_reply)
-        self.prompt_suggestions = self._generate_prompt_suggestions(clean)
-        return clean
+        # Continue the server-side chain only when it holds this reply; a new profile resets it below.
+        self._last_response_id = chain_resp.id if chain_resp is not None else None
+        if chain_resp is None:
+            self._chained_turns = 0
+        return self._process_final_reply(agent_reply)
 
 
 def run_cli():
@@ -733,8 +1378,18 @@ def run_cli():
         if user_input.lower() in ["exit", "quit", "stop"]:
             print("👋 Goodbye! Stay healthy.")
             break
-        reply = session.step(user_input)
-        print("\nAssistant:", reply, "\n")
+        print("\nAssistant: ", end="", flush=True)
+        streamed: List[str] = []
+
+        def on_delta(delta: str) -> None:
+            streamed.append(delta)
+            print(delta, end="", flush=True)
+
+        reply = session.step(user_input, on_delta=on_delta)
+        shown = "".join(streamed)
+        # Print whatever post-processing added (or the full reply if it rewrote the text).
+        remainder = reply[len(shown) :] if reply.startswith(shown) else ("\n\n" + reply if shown else reply)
+        print(remainder, "\n")
 
 
 if __name__ == "__main__":
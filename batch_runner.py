@@ -0,0 +1,124 @@
+"""
+Offline runner: send many single-turn prompts through the OpenAI Batch API.
+
+For evals and bulk re-scoring only (half the per-token cost, results within 24h);
+the live CLI/Streamlit path keeps using AgentSession.step.
+
+Usage: python batch_runner.py prompts.txt results.jsonl
+"""
+
+import io
+import logging
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import orjson
+from openai import OpenAI
+
+from agent import client, execute_tool, parse_tool_arguments
+from prompts import build_system_prompt
+from tools import tools
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+MAX_OUTPUT_TOKENS = 250  # matches AgentSession.MAX_OUT
+
+
+def build_batch_request(custom_id: str, prompt: str, profile: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """One Batch API line with the same input shape as AgentSession's first call."""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/responses",
+        "body": {
+            "model": "gpt-4o-mini",
+            "input": [
+                {"role": "system", "content": build_system_prompt(profile or {})},
+                {"role": "user", "content": prompt},
+            ],
+            "tools": tools,
+            "tool_choice": "auto",
+            "max_output_tokens": MAX_OUTPUT_TOKENS,
+        },
+    }
+
+
+def _parse_batch_line(line: str) -> Dict[str, Any]:
+    """Reduce one Batch output line to text plus locally executed tool results."""
+    record = orjson.loads(line)
+    body = (record.get("response") or {}).get("body") or {}
+    text_parts: List[str] = []
+    tool_results: List[Dict[str, Any]] = []
+    for item in body.get("output", []):
+        if item.get("type") == "message":
+            text_parts.extend(c.get("text", "") for c in item.get("content", []) if c.get("type") == "output_text")
+        elif item.get("type") == "function_call":
+            # second pass: run the requested tools here, as the live loop would;
+            # a failing tool is recorded on its line instead of sinking the whole batch
+            name = item.get("name")
+            try:
+                tool_results.append({"name": name, "result": execute_tool(name, parse_tool_arguments(item.get("arguments")))})
+            except Exception as exc:
+                tool_results.append({"name": name, "error": f"{type(exc).__name__}: {exc}"})
+    return {
+        "custom_id": record.get("custom_id"),
+        "output_text": "".join(text_parts),
+        "tool_results": tool_results,
+        "error": record.get("error"),
+    }
+
+
+def run_batch(
+    prompts: List[str],
+    out_path: str,
+    batch_client: Optional[OpenAI] = None,
+    poll_interval: float = 30.0,
+) -> List[Dict[str, Any]]:
+    """
+    Submit prompts as one batch, wait for it to finish and write one JSON result per line to out_path.
+    Results are returned in prompt order, matched back by custom_id.
+    """
+    api = batch_client or client
+    requests = [build_batch_request(f"prompt-{idx}", prompt) for idx, prompt in enumerate(prompts)]
+    payload = b"\n".join(orjson.dumps(req) for req in requests)
+
+    input_file = api.files.create(file=("batch_input.jsonl", io.BytesIO(payload)), purpose="batch")
+    batch = api.batches.create(input_file_id=input_file.id, endpoint="/v1/responses", completion_window="24h")
+    while batch.status not in TERMINAL_STATUSES:
+        time.sleep(poll_interval)
+        batch = api.batches.retrieve(batch.id)
+    if batch.status != "completed" or not batch.output_file_id:
+        raise RuntimeError(f"Batch {batch.id} finished with status {batch.status}")
+
+    by_id = {}
+    for line in api.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            parsed = _parse_batch_line(line)
+        except (orjson.JSONDecodeError, AttributeError, TypeError) as exc:
+            # its prompt is reported as missing from the batch output below
+            logger.warning("Skipping unreadable batch output line: %s", exc)
+            continue
+        by_id[parsed["custom_id"]] = parsed
+
+    results = []
+    for req, prompt in zip(requests, prompts):
+        result = by_id.get(req["custom_id"], {"custom_id": req["custom_id"], "error": "missing from batch output"})
+        results.append({"prompt": prompt, **result})
+
+    with open(out_path, "w", encoding="utf-8") as fh:
+        for result in results:
+            fh.write(orjson.dumps(result).decode() + "\n")
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("Usage: python batch_runner.py prompts.txt results.jsonl")
+    with open(sys.argv[1], encoding="utf-8") as fh:
+        prompt_lines = [line.strip() for line in fh if line.strip()]
+    done = run_batch(prompt_lines, sys.argv[2])
+    print(f"Wrote {len(done)} results to {sys.argv[2]}")
@@ -0,0 +1,21 @@
+"""Process-wide OpenAI client shared by the agent, the tools and the UI."""
+
+import atexit
+import os
+
+import httpx
+from dotenv import load_dotenv
+from openai import OpenAI
+
+load_dotenv()
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+# One keep-alive HTTP/2 pool for every AgentSession and tool call in the process, so
+# they reuse warm connections instead of paying a TLS handshake each.
+_http = httpx.Client(
+    http2=True,
+    timeout=httpx.Timeout(30.0),
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+)
+atexit.register(_http.close)
+client = OpenAI(api_key=OPENAI_API_KEY, http_client=_http)
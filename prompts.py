@@ -1,10 +1,33 @@
+import json
+from functools import lru_cache
+
+
 # --- System Prompt for the Agent (LLM chooses tools) ---
 def build_system_prompt(profile):
-    return f"""
-You are NHS 101, a healthcare navigation assistant for London Business School students.
+    """Return the system prompt for a profile, memoized on its canonical JSON form."""
+    try:
+        # sorted keys: equal profiles share one cache entry and one byte-identical prompt prefix
+        profile_key = json.dumps(profile, sort_keys=True)
+    except (TypeError, ValueError):
+        return _render_system_prompt(profile)
+    return _cached_system_prompt(profile_key)
+
+
+@lru_cache(maxsize=32)
+def _cached_system_prompt(profile_key):
+    return _render_system_prompt(json.loads(profile_key))
+
+
+def _render_system_prompt(profile):
+    # profile goes last: the static instructions stay a byte-identical prefix across users (prompt cache)
+    return f"""{SYSTEM_PROMPT_STATIC}
 
 Stored user profile (may be empty initially):
-{profile}
+{profile}"""
+
+
+SYSTEM_PROMPT_STATIC = """
+You are NHS 101, a healthcare navigation assistant for London Business School students.
 
 Your goals:
 - Provide clear, safe, informational guidance about UK healthcare.
@@ -21,7 +44,7 @@ Linking / sources rule (MANDATORY):
 - Format as bullets: "- Title: URL". Use full https:// URLs (no markdown link syntax) and do not break URLs across lines.
 - Do NOT include non-official sources unless guided_search explicitly returns them.
 - IMPORTANT EXCEPTION: If you are in the special onboarding completion step where you must output
-  only <USER_PROFILE>{{...}}</USER_PROFILE> with no extra text before it, do NOT add Useful links
+  only <USER_PROFILE>{...}</USER_PROFILE> with no extra text before it, do NOT add Useful links
   in that message. You may add links in the following normal message if needed.
 
 Tool-routing rules (STRICT):
@@ -44,7 +67,7 @@ PRIORITY ORDER:
    - Do NOT ask for extra info (DOB, phone, email, gender, nationality, etc.).
    - If the user goes off-topic, tell them you'll answer after onboarding and repeat the current question.
    - When ALL questions are answered, your VERY NEXT message must be:
-     <USER_PROFILE>{{...}}</USER_PROFILE>
+     <USER_PROFILE>{...}</USER_PROFILE>
      with no extra text before it. Then briefly confirm onboarding is complete.
 
 2) **Nearby services:**
@@ -0,0 +1,76 @@
+"""Shared fakes and base test case for the offline suite; the OpenAI client is never called."""
+
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import httpx
+from openai import RateLimitError
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import agent  # noqa: E402
+
+
+def text_response(text: str, response_id: str = "resp_1", input_tokens: int = 0) -> SimpleNamespace:
+    message = SimpleNamespace(type="message", content=[SimpleNamespace(type="output_text", text=text)])
+    return SimpleNamespace(
+        id=response_id, status="completed", output=[message], output_text=text,
+        usage=SimpleNamespace(input_tokens=input_tokens),
+    )
+
+
+def tool_call_response(name: str, arguments: str, response_id: str = "resp_1", call_id: str = "call_1") -> SimpleNamespace:
+    call = SimpleNamespace(type="function_call", name=name, call_id=call_id, arguments=arguments)
+    return SimpleNamespace(id=response_id, status="completed", output=[call], output_text="", usage=None)
+
+
+def api_error(error_class=RateLimitError, status_code: int = 429):
+    """An openai APIStatusError subclass instance, as the SDK would raise it."""
+    response = httpx.Response(status_code, request=httpx.Request("POST", "https://api.openai.com/v1/responses"))
+    return error_class("rejected", response=response, body=None)
+
+
+class FakeResponses:
+    """
+    Records every responses.create call; answers from `script` first, then with a fixed text reply.
+    Exception instances in the script are raised instead of returned.
+    """
+
+    def __init__(self, reply: str = "model reply", script=()):
+        self.reply = reply
+        self.script = list(script)
+        self.calls = []
+
+    def create(self, **kwargs):
+        # snapshot: safe_create may rewrite its kwargs between retries
+        self.calls.append(dict(kwargs))
+        if self.script:
+            answer = self.script.pop(0)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+        return text_response(self.reply, f"resp_{len(self.calls)}")
+
+
+def make_session(reply: str = "model reply", script=()):
+    fake = SimpleNamespace(responses=FakeResponses(reply, script))
+    return agent.AgentSession(client_override=fake), fake.responses
+
+
+class AgentTestCase(unittest.TestCase):
+    """Starts every test with empty process-wide caches, so results never depend on test order."""
+
+    def setUp(self):
+        agent._RESPONSE_CACHE.clear()
+        for cache in agent._TOOL_CACHES.values():
+            cache.clear()
+
+    def patch_tools(self, **handlers):
+        """Swap tool handlers in agent.TOOL_REGISTRY for the duration of the test."""
+        patcher = mock.patch.object(agent, "TOOL_REGISTRY", {**agent.TOOL_REGISTRY, **handlers})
+        patcher.start()
+        self.addCleanup(patcher.stop)
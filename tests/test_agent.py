@@ -0,0 +1,309 @@
+"""Offline tests for AgentSession routing; the OpenAI client is replaced by a scripted fake."""
+
+import unittest
+from unittest import mock
+
+from openai import BadRequestError, NotFoundError
+
+from support import AgentTestCase, api_error, make_session, text_response, tool_call_response
+
+import agent
+import tools
+
+
+class EmergencyFastPathTest(AgentTestCase):
+    def test_red_flags_skip_the_model(self):
+        for message in ["I have chest pain", "I feel suicidal", "my friend took an overdose"]:
+            session, responses = make_session()
+            reply = session.step(message)
+            self.assertEqual(responses.calls, [], message)
+            self.assertIn("999", reply, message)
+
+    def test_benign_and_negated_phrases_reach_the_model(self):
+        for message in [
+            "Is heatstroke common in London?",
+            "What a stroke of luck, I found a GP",
+            "I like brushstroke painting",
+            "Dealing with the collapse of my business",
+            "no chest pain, just a cough",
+            "I'm not suicidal, just stressed",
+        ]:
+            session, responses = make_session()
+            reply = session.step(message)
+            self.assertEqual(len(responses.calls), 1, message)
+            self.assertEqual(reply, "model reply", message)
+
+    def test_triage_answers_are_left_to_the_triage_flow(self):
+        session, responses = make_session()
+        session.triage_active = True
+        session.triage_known_answers = {"onset": "yesterday"}
+        session.step("it started as chest pain but now it's just a cough")
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(session.triage_known_answers, {"onset": "yesterday"})
+
+
+class ToolCacheTest(AgentTestCase):
+    def fake_tool(self, results):
+        calls = []
+
+        def tool(arguments):
+            calls.append(arguments)
+            return results[min(len(calls), len(results)) - 1]
+
+        self.patch_tools(nearest_nhs_services=tool)
+        return calls
+
+    def test_failed_lookups_are_not_cached(self):
+        calls = self.fake_tool([{"raw": "not json", "url": "https://www.nhs.uk"}, [{"name": "GP One"}]])
+        args = {"postcode_full": "NW1 2BU", "service_type": "GP", "n": 3}
+        self.assertIn("raw", agent.execute_tool("nearest_nhs_services", args))
+        self.assertEqual(agent.execute_tool("nearest_nhs_services", args), [{"name": "GP One"}])
+        self.assertEqual(agent.execute_tool("nearest_nhs_services", args), [{"name": "GP One"}])
+        self.assertEqual(len(calls), 2)
+
+    def test_cache_hits_return_copies(self):
+        self.fake_tool([[{"name": "GP One"}]])
+        args = {"postcode_full": "NW1 2BU", "service_type": "GP", "n": 3}
+        agent.execute_tool("nearest_nhs_services", args).append({"name": "injected"})
+        agent.execute_tool("nearest_nhs_services", args)[0]["name"] = "changed"
+        self.assertEqual(agent.execute_tool("nearest_nhs_services", args), [{"name": "GP One"}])
+
+
+class ResponseChainTest(AgentTestCase):
+    def chat(self, session, turns):
+        for i in range(turns):
+            session.step(f"question {i}")
+
+    def test_turns_chain_until_max_chained_turns(self):
+        session, responses = make_session()
+        self.chat(session, session.MAX_CHAINED_TURNS + 1)
+        chained = ["previous_response_id" in call for call in responses.calls]
+        self.assertEqual(chained, [False] + [True] * (session.MAX_CHAINED_TURNS - 1) + [False])
+        self.assertEqual(responses.calls[1]["input"], [{"role": "user", "content": "question 1"}])
+        self.assertEqual(responses.calls[-1]["input"][0], session.system_message)
+
+    def test_chain_restarts_once_it_outgrows_the_token_budget(self):
+        session, responses = make_session(script=[text_response("long answer", "resp_big", input_tokens=6500)])
+        self.chat(session, 2)
+        self.assertNotIn("previous_response_id", responses.calls[1])
+        self.assertEqual(responses.calls[1]["input"][0], session.system_message)
+
+    def assert_falls_back_to_the_history_window(self, error):
+        session, responses = make_session(script=[text_response("hello", "resp_a"), error])
+        self.chat(session, 2)
+        self.assertEqual(responses.calls[1]["previous_response_id"], "resp_a")
+        self.assertNotIn("previous_response_id", responses.calls[2])
+        self.assertEqual(responses.calls[2]["input"][0], session.system_message)
+        self.assertEqual(session._last_response_id, "resp_3")
+
+    def test_rejected_chain_falls_back_to_the_history_window(self):
+        self.assert_falls_back_to_the_history_window(api_error(BadRequestError, 400))
+
+    def test_expired_chain_falls_back_to_the_history_window(self):
+        self.assert_falls_back_to_the_history_window(api_error(NotFoundError, 404))
+
+    def test_new_profile_restarts_the_chain(self):
+        session, responses = make_session()
+        self.chat(session, 1)
+        session._process_final_reply('<USER_PROFILE>{"name": "Sam"}</USER_PROFILE>Saved.')
+        self.chat(session, 1)
+        self.assertNotIn("previous_response_id", responses.calls[-1])
+        self.assertEqual(responses.calls[-1]["input"][0], session.system_message)
+
+
+class RollingSummaryTest(AgentTestCase):
+    def fill_history(self, session, messages):
+        session.HISTORY_WINDOW, session.SUMMARY_BATCH = 4, 2
+        for i in range(messages):
+            session._append_history("user" if i % 2 == 0 else "assistant", f"m{i}")
+
+    def test_messages_leaving_the_window_are_summarised(self):
+        session, responses = make_session(script=[text_response("Sam asked about GPs.")])
+        self.fill_history(session, 7)
+        session.step("and dentists?")
+        summary_call, turn_call = responses.calls
+        self.assertIn("user: m0\nassistant: m1\nuser: m2\nassistant: m3", summary_call["input"])
+        self.assertEqual(session.history_summary, "Sam asked about GPs.")
+        self.assertEqual(session._summarized_upto, session._window_start)
+        self.assertEqual(turn_call["input"][1], {"role": "system", "content": "Prior conversation summary: Sam asked about GPs."})
+
+    def test_failed_summary_is_retried_next_turn(self):
+        session, responses = make_session(script=[RuntimeError("timeout")])
+        self.fill_history(session, 7)
+        session.step("and dentists?")
+        self.assertEqual((session.history_summary, session._summarized_upto), ("", 0))
+        self.assertEqual(len(responses.calls[-1]["input"]), 1 + 4)
+
+
+class RateLimitTrimTest(AgentTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(agent.time, "sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_history_keeps_system_messages_and_the_latest_turns(self):
+        session, responses = make_session(script=[api_error(), api_error()])
+        history = [{"role": "user" if i % 2 else "assistant", "content": f"m{i}"} for i in range(6)]
+        session.safe_create(model="gpt-4o-mini", input=[session.system_message, *history])
+        self.assertEqual(responses.calls[-1]["input"], [session.system_message, *history[-3:]])
+
+    def test_tool_outputs_are_never_dropped(self):
+        session, responses = make_session(script=[api_error(), api_error()])
+        outputs = [{"type": "function_call_output", "call_id": f"c{i}", "output": "{}"} for i in range(5)]
+        session.safe_create(model="gpt-4o-mini", previous_response_id="resp_0", input=outputs)
+        self.assertEqual(responses.calls[-1]["input"], outputs)
+        self.assertEqual(responses.calls[-1]["max_output_tokens"], 150)
+
+
+class ResponseCacheTest(AgentTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(agent.time, "sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ask(self, script=()):
+        session, responses = make_session(script=script)
+        return session.step("How do I register with a GP?"), responses
+
+    def test_identical_opening_turns_are_answered_from_memory(self):
+        self.ask()
+        reply, responses = self.ask()
+        self.assertEqual(reply, "model reply")
+        self.assertEqual(responses.calls, [])
+
+    def test_replies_to_a_rate_limit_trimmed_request_are_not_cached(self):
+        _, limited = self.ask(script=[api_error(), api_error()])
+        self.assertEqual(limited.calls[-1]["max_output_tokens"], 150)
+        _, responses = self.ask()
+        self.assertEqual(len(responses.calls), 1)
+        self.assertGreater(responses.calls[0]["max_output_tokens"], 150)
+
+    def test_truncated_replies_are_not_cached(self):
+        truncated = text_response("Register by", "resp_cut")
+        truncated.status = "incomplete"
+        self.ask(script=[truncated])
+        _, responses = self.ask()
+        self.assertEqual(len(responses.calls), 1)
+
+
+class PostcodePrefetchTest(AgentTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(agent, "prefetch_nearest_services")
+        self.prefetch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def finish_onboarding(self, postcode):
+        session, _ = make_session()
+        session._process_final_reply(f'<USER_PROFILE>{{"postcode": "{postcode}"}}</USER_PROFILE>Done.')
+
+    def test_only_full_postcodes_are_prefetched(self):
+        for postcode in ["nw1  2bu", "NW1", "Camden", "prefer not to say"]:
+            self.finish_onboarding(postcode)
+        self.assertEqual(self.prefetch.call_args_list, [mock.call("NW1 2BU")])
+
+
+class PrefetchSlotTest(AgentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+        self.patch_tools(nearest_nhs_services=lambda arguments: self.calls.append(arguments) or [{"name": "GP One"}])
+        self.args = {"postcode_full": "NW1 2BU", "service_type": "GP", "n": 3}
+
+    def test_prefetch_fills_the_cache_when_a_slot_is_free(self):
+        agent._prefetch_lookup(self.args)
+        self.assertEqual(agent.execute_tool("nearest_nhs_services", self.args), [{"name": "GP One"}])
+        self.assertEqual(len(self.calls), 1)
+
+    def test_prefetch_is_skipped_while_live_lookups_hold_every_slot(self):
+        semaphore = agent._TOOL_SEMAPHORES["nearest_nhs_services"]
+        held = [semaphore.acquire(blocking=False) for _ in range(agent.TOOL_CONCURRENCY["nearest_nhs_services"])]
+        try:
+            agent._prefetch_lookup(self.args)
+        finally:
+            for _ in held:
+                semaphore.release()
+        self.assertEqual(self.calls, [])
+
+
+class PromptSuggestionsTest(AgentTestCase):
+    def test_generated_on_first_request_only(self):
+        session, responses = make_session('```json\n["Find a GP", "What is NHS 111?"]\n```')
+        session.step("How do I register with a GP?")
+        self.assertEqual(len(responses.calls), 1)
+        self.assertFalse(session.prompt_suggestions_ready)
+        self.assertEqual(session.get_prompt_suggestions(), ["Find a GP", "What is NHS 111?"])
+        self.assertTrue(session.prompt_suggestions_ready)
+        self.assertEqual(session.get_prompt_suggestions(), ["Find a GP", "What is NHS 111?"])
+        self.assertEqual(len(responses.calls), 2)
+
+
+class ProfileFollowupsTest(AgentTestCase):
+    def test_fenced_or_prefixed_json_is_parsed(self):
+        payload = '{"followups": "1) See a GP", "suggestions": ["Find a GP", "Book a jab"]}'
+        for reply in [payload, f"```json\n{payload}\n```", f"Here you go:\n{payload}"]:
+            agent._RESPONSE_CACHE.clear()
+            session, _ = make_session(reply)
+            session.user_profile = {"postcode": "NW1 2BU"}
+            self.assertEqual(session._generate_ui_extras("Welcome"), "1) See a GP", reply)
+            self.assertEqual(session.prompt_suggestions, ["Find a GP", "Book a jab"], reply)
+
+
+class ToolSchemaTest(AgentTestCase):
+    def setUp(self):
+        super().setUp()
+        final = {"status": "final", "suggested_service": "NHS_111", "should_lookup": False}
+        self.patch_tools(nhs_111_live_triage=lambda arguments: final)
+
+    def test_chained_text_only_follow_up_keeps_the_tool_schema(self):
+        triage_call = tool_call_response("nhs_111_live_triage", '{"presenting_issue": "sore throat"}')
+        session, responses = make_session("Use NHS 111 online.", script=[triage_call])
+        self.assertEqual(session.step("I have a sore throat"), "Use NHS 111 online.")
+
+        follow_up = responses.calls[1]
+        self.assertEqual(follow_up["previous_response_id"], triage_call.id)
+        self.assertEqual(follow_up["input"][0]["type"], "function_call_output")
+        self.assertEqual(follow_up["tool_choice"], "none")
+        self.assertIs(follow_up["tools"], agent.tools)
+
+    def test_text_only_call_without_tool_outputs_drops_the_schema(self):
+        session, responses = make_session()
+        session.safe_create(model="gpt-4o-mini", input=[{"role": "user", "content": "hi"}], tools=agent.tools, tool_choice="none")
+        self.assertNotIn("tools", responses.calls[0])
+        self.assertNotIn("tool_choice", responses.calls[0])
+
+
+class TriageRedFlagTest(AgentTestCase):
+    def test_red_flag_presenting_issue_skips_the_model(self):
+        with mock.patch.object(tools, "client") as api:
+            result = tools.nhs_111_live_triage({"presenting_issue": "sudden chest pain", "postcode_full": "NW1 2BU"})
+        api.responses.create.assert_not_called()
+        self.assertEqual(result["status"], "final")
+        self.assertEqual(result["suggested_service"], "A&E")
+        self.assertEqual(agent.nearest_lookup_args("nhs_111_live_triage", result)["postcode_full"], "NW1 2BU")
+
+    def test_final_postcode_is_the_callers_not_the_models(self):
+        reply = text_response('{"status": "final", "suggested_service": "GP", "postcode_full": "SW1A 1AA", "should_lookup": true}')
+        for postcode, expected in [("NW1 2BU", "NW1 2BU"), (None, None)]:
+            with mock.patch.object(tools, "client") as api:
+                api.responses.create.return_value = reply
+                result = tools.nhs_111_live_triage({"presenting_issue": "sore knee", "postcode_full": postcode})
+            self.assertEqual(result.get("postcode_full"), expected)
+        self.assertIsNone(agent.nearest_lookup_args("nhs_111_live_triage", result))
+
+
+class OnboardingPayloadTest(AgentTestCase):
+    def test_callers_cannot_alter_the_shared_questionnaire(self):
+        first = agent.execute_tool("onboarding", {})
+        first["questions"].pop()
+        first["mode"] = "changed"
+        second = agent.execute_tool("onboarding", {})
+        self.assertEqual(second["mode"], "llm_multiturn_onboarding")
+        self.assertEqual(len(second["questions"]), len(agent.tool_onboarding()["questions"]))
+        self.assertEqual(second, tools.ONBOARDING_PAYLOAD)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+"""Offline tests for batch_runner output handling."""
+
+import io
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import orjson
+from support import AgentTestCase
+
+import batch_runner
+
+
+def output_line(custom_id: str, tool_name: str) -> str:
+    body = {"output": [{"type": "function_call", "name": tool_name, "arguments": "{}"}]}
+    return orjson.dumps({"custom_id": custom_id, "response": {"body": body}, "error": None}).decode()
+
+
+class FakeBatchApi:
+    def __init__(self, output_text: str):
+        self.files = SimpleNamespace(
+            create=lambda file, purpose: SimpleNamespace(id="file-in"),
+            content=lambda file_id: SimpleNamespace(text=output_text),
+        )
+        self.batches = SimpleNamespace(
+            create=lambda **kwargs: SimpleNamespace(id="batch-1", status="completed", output_file_id="file-out"),
+        )
+
+
+class RunBatchTest(AgentTestCase):
+    def setUp(self):
+        super().setUp()
+
+        def broken(arguments):
+            raise ValueError("bad postcode")
+
+        self.patch_tools(broken=broken)
+
+    def test_tool_errors_and_bad_lines_do_not_lose_the_batch(self):
+        output = "\n".join([output_line("prompt-0", "broken"), "{not json", output_line("prompt-2", "nope")])
+        with tempfile.TemporaryDirectory() as tmp:
+            out_path = os.path.join(tmp, "results.jsonl")
+            results = batch_runner.run_batch(["a", "b", "c"], out_path, batch_client=FakeBatchApi(output))
+            with io.open(out_path, encoding="utf-8") as fh:
+                written = [orjson.loads(line) for line in fh]
+
+        self.assertEqual(written, results)
+        self.assertEqual(results[0]["tool_results"], [{"name": "broken", "error": "ValueError: bad postcode"}])
+        self.assertEqual(results[1]["error"], "missing from batch output")
+        self.assertEqual(results[2]["tool_results"][0]["name"], "nope")
+
+
+if __name__ == "__main__":
+    unittest.main()